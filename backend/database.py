@@ -3,26 +3,27 @@ from __future__ import annotations
 import os
 from typing import Any, Dict, Optional
 
-from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import AsyncMongoClient
+from pymongo.asynchronous.database import AsyncDatabase
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import datetime, timezone
 
 
 MONGO_URL = os.getenv("DATABASE_URL", "mongodb://localhost:27017")
 DB_NAME = os.getenv("DATABASE_NAME", "appdb")
 
-_client: Optional[AsyncIOMotorClient] = None
-_db: Optional[AsyncIOMotorDatabase] = None
+_client: Optional[AsyncMongoClient] = None
+_db: Optional[AsyncDatabase] = None
 
 
-def get_client() -> AsyncIOMotorClient:
+def get_client() -> AsyncMongoClient:
     global _client
     if _client is None:
-        _client = AsyncIOMotorClient(MONGO_URL)
+        _client = AsyncMongoClient(MONGO_URL, maxPoolSize=100)
     return _client
 
 
-def get_db() -> AsyncIOMotorDatabase:
+def get_db() -> AsyncDatabase:
     global _db
     if _db is None:
         _db = get_client()[DB_NAME]
@@ -32,17 +33,22 @@ def get_db() -> AsyncIOMotorDatabase:
 # Helper functions
 async def create_document(collection_name: str, data: Dict[str, Any]) -> Dict[str, Any]:
     db = get_db()
-    payload = {**data, "created_at": datetime.utcnow(), "updated_at": datetime.utcnow()}
+    now = datetime.now(timezone.utc)
+    payload = {**data, "created_at": now, "updated_at": now}
     result = await db[collection_name].insert_one(payload)
-    doc = await db[collection_name].find_one({"_id": result.inserted_id})
-    if doc and "_id" in doc:
-        doc["id"] = str(doc.pop("_id"))
-    return doc or {}
+    # insert_one adds _id to payload; echo the doc back without a re-fetch
+    payload.pop("_id", None)
+    return {"id": str(result.inserted_id), **payload}
 
 
-async def get_documents(collection_name: str, filter_dict: Dict[str, Any] | None = None, limit: int = 50):
+async def get_documents(
+    collection_name: str,
+    filter_dict: Dict[str, Any] | None = None,
+    limit: int = 50,
+    projection: Dict[str, Any] | None = None,
+):
     db = get_db()
-    cursor = db[collection_name].find(filter_dict or {}).limit(limit)
+    cursor = db[collection_name].find(filter_dict or {}, projection).limit(limit)
     items = []
     async for doc in cursor:
         if doc and "_id" in doc:
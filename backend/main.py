@@ -2,13 +2,14 @@ from __future__ import annotations
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
 from typing import List
 
 from database import create_document, get_documents
-from schemas import Clip
+from schemas import Clip, Creator
 
-app = FastAPI(title="Social Clips API", version="1.0.0")
+app = FastAPI(title="Social Clips API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # CORS
 app.add_middleware(
@@ -24,8 +25,21 @@ class ClipCreate(Clip):
     pass
 
 
-class ClipsResponse(BaseModel):
-    items: List[Clip]
+# Clip has no id field, so leave _id (and timestamps) on the server
+CLIP_PROJECTION = {"_id": 0, **{name: 1 for name in Clip.model_fields}}
+CLIP_LIST_ADAPTER = TypeAdapter(List[Clip])
+_CLIP_REQUIRED = tuple(name for name, f in Clip.model_fields.items() if f.is_required())
+_CREATOR_REQUIRED = tuple(name for name, f in Creator.model_fields.items() if f.is_required())
+
+
+def _has_required_fields(doc) -> bool:
+    # model_construct doesn't validate, so at least skip docs missing required keys
+    creator = doc.get("creator")
+    return (
+        all(doc.get(name) is not None for name in _CLIP_REQUIRED)
+        and isinstance(creator, dict)
+        and all(creator.get(name) is not None for name in _CREATOR_REQUIRED)
+    )
 
 
 @app.get("/test")
@@ -35,23 +49,27 @@ async def test():
     return {"status": "ok", "count": len(items)}
 
 
-@app.get("/clips", response_model=ClipsResponse)
+@app.get("/clips")
 async def list_clips(limit: int = 20):
-    items = await get_documents("clip", {}, limit)
-    # Pydantic model compatibility: ensure keys present
+    items = await get_documents("clip", {}, limit, projection=CLIP_PROJECTION)
+    # Clips are validated once, by create_clip on the way in, so the read path
+    # trusts stored data and builds models without re-validating (or re-parsing
+    # every URL). Docs written by other means only get the required-key check.
     parsed = []
     for it in items:
-        try:
-            parsed.append(Clip(**it))
-        except Exception:
+        if not _has_required_fields(it):
             # Skip invalid docs
             continue
-    return {"items": parsed}
+        parsed.append(Clip.model_construct(**{**it, "creator": Creator.model_construct(**it["creator"])}))
+    # Serialize the whole batch in one call; the result is plain JSON types,
+    # so skip jsonable_encoder and response_model
+    return ORJSONResponse({"items": CLIP_LIST_ADAPTER.dump_python(parsed, mode="json", warnings=False)})
 
 
 @app.post("/clips", response_model=Clip, status_code=201)
 async def create_clip(payload: ClipCreate):
-    doc = await create_document("clip", payload.model_dump())
+    # json mode stores URLs as plain strings, which BSON can encode
+    doc = await create_document("clip", payload.model_dump(mode="json"))
     if not doc:
         raise HTTPException(status_code=500, detail="Failed to create clip")
     return Clip(**doc)
@@ -5,7 +5,7 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from pymongo import AsyncMongoClient, MongoClient
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
@@ -15,19 +15,45 @@ from pydantic import BaseModel
 # Load environment variables from .env file
 load_dotenv()
 
-_client = None
-db = None
-
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+_client = None
+_db = None
+
+
+def get_sync_db():
+    """Sync database handle for scripts and helpers (None if not configured)"""
+    global _client, _db
+    if _db is None and database_url and database_name:
+        _client = MongoClient(database_url)
+        _db = _client[database_name]
+    return _db
+
+
+def __getattr__(name):
+    # keep `from database import db` working without connecting at import time
+    if name == "db":
+        return get_sync_db()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+_async_client = None
+_async_db = None
+
+
+def get_db():
+    """Async database handle for request handlers (None if not configured)"""
+    global _async_client, _async_db
+    if _async_db is None and database_url and database_name:
+        _async_client = AsyncMongoClient(database_url)
+        _async_db = _async_client[database_name]
+    return _async_db
 
 # Helper functions for common database operations
 def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
+    db = get_sync_db()
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
 
@@ -37,14 +63,16 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    now = datetime.now(timezone.utc)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
 
     result = db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
 def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
+    db = get_sync_db()
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
     
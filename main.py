@@ -1,25 +1,44 @@
+import asyncio
+import logging
 import os
-from datetime import datetime, timedelta
-from typing import Optional, List
-
+from copy import copy
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, Optional, List
+
+import bcrypt
+import jwt
+import orjson
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from bson import ObjectId
+from bson.errors import InvalidId
+from cachetools import TTLCache
 from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
-from jose import jwt, JWTError
-from passlib.context import CryptContext
 
-from pydantic import BaseModel, EmailStr
+from pydantic import AfterValidator, BaseModel, EmailStr, StringConstraints, TypeAdapter
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
-from database import db
+from database import get_db
 from schemas import User
 
+logger = logging.getLogger(__name__)
+
 SECRET_KEY = os.getenv("SECRET_KEY", "secret-dev-key")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 14  # 14 days
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# argon2id for new hashes; bcrypt hashes are still accepted at login
+pwd_hasher = PasswordHasher(time_cost=2, memory_cost=19456, parallelism=1)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
+# user_id -> user doc, per process and up to 5s stale. Only get_cached_user
+# reads it, for endpoints that need just the caller's _id; anything that reads
+# profile fields uses get_current_user so it sees the caller's own writes.
+_USER_CACHE = TTLCache(maxsize=10_000, ttl=5)
+
 
 class Token(BaseModel):
     access_token: str
@@ -46,7 +65,27 @@ class UserPublic(BaseModel):
     verified: bool = False
 
 
-app = FastAPI(title="Dating App API")
+USER_PUBLIC_LIST_ADAPTER = TypeAdapter(List[UserPublic])
+
+# Fallbacks for fields missing from older user documents. model_construct
+# keeps values as-is, so user_entity copies these rather than sharing them.
+_USER_DEFAULTS = {
+    "email": None,
+    "full_name": None,
+    "photos": [],
+    "bio": None,
+    "gender": None,
+    "show_me": None,
+    "age_range": [18, 35],
+    "distance_km": 50,
+    "interests": [],
+    "verified": False,
+}
+_USER_FIELDS = tuple(_USER_DEFAULTS)
+USER_PUBLIC_PROJECTION = dict.fromkeys(_USER_FIELDS, 1)
+
+
+app = FastAPI(title="Dating App API", default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -56,67 +95,131 @@ app.add_middleware(
 )
 
 
+INDEXES = [
+    ("user", [("email", 1)], {"unique": True}),
+    ("like", [("liker_id", 1), ("liked_id", 1)], {"unique": True}),
+    ("match", [("user_a", 1), ("user_b", 1)], {"unique": True}),
+    ("match", [("user_b", 1), ("user_a", 1)], {}),
+    ("message", [("match_id", 1), ("created_at", 1)], {}),
+]
+
+
+async def ensure_indexes(db):
+    # Only creates indexes. Older databases may hold duplicates that make the
+    # unique ones fail; those are logged, and `python migrate.py` cleans them up.
+    for collection, keys, options in INDEXES:
+        try:
+            await db[collection].create_index(keys, **options)
+        except PyMongoError:
+            logger.exception(
+                "Could not create index %s on %s; run migrate.py if this is a duplicate key error",
+                keys,
+                collection,
+            )
+
+
+@app.on_event("startup")
+async def schedule_index_creation():
+    # Run in the background so an unreachable database can't block startup;
+    # /test still reports its status
+    db = get_db()
+    if db is None:
+        return
+    app.state.index_task = asyncio.create_task(ensure_indexes(db))
+
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    if hashed_password.startswith("$2"):
+        # bcrypt only looks at the first 72 bytes
+        try:
+            return bcrypt.checkpw(plain_password.encode()[:72], hashed_password.encode())
+        except ValueError:
+            return False
+    try:
+        return pwd_hasher.verify(hashed_password, plain_password)
+    except (VerificationError, InvalidHashError):
+        return False
 
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return pwd_hasher.hash(password)
+
+
+def password_needs_rehash(hashed_password):
+    # legacy bcrypt hashes, or argon2 hashes made with older parameters
+    if hashed_password.startswith("$2"):
+        return True
+    try:
+        return pwd_hasher.check_needs_rehash(hashed_password)
+    except InvalidHashError:
+        return False
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    expire = datetime.now(timezone.utc) + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    return jwt.encode({**data, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
 
 
-def get_user_by_email(email: str) -> Optional[dict]:
+async def get_user_by_email(email: str) -> Optional[dict]:
+    db = get_db()
     if db is None:
         return None
-    return db["user"].find_one({"email": email})
+    return await db["user"].find_one({"email": email})
 
 
-def get_user_by_id(user_id: str) -> Optional[dict]:
+async def get_user_by_id(user_id: str) -> Optional[dict]:
+    db = get_db()
     if db is None:
         return None
-    from bson import ObjectId
-    return db["user"].find_one({"_id": ObjectId(user_id)})
+    return await db["user"].find_one({"_id": ObjectId(user_id)})
 
 
 def user_entity(doc: dict) -> UserPublic:
-    return UserPublic(
-        id=str(doc.get("_id")),
-        email=doc.get("email"),
-        full_name=doc.get("full_name"),
-        photos=doc.get("photos", []),
-        bio=doc.get("bio"),
-        gender=doc.get("gender"),
-        show_me=doc.get("show_me"),
-        age_range=doc.get("age_range", [18, 35]),
-        distance_km=doc.get("distance_km", 50),
-        interests=doc.get("interests", []),
-        verified=doc.get("verified", False),
+    # User docs are written by register/update_me, so skip re-validation
+    return UserPublic.model_construct(
+        id=str(doc["_id"]),
+        **{k: doc[k] if k in doc else copy(_USER_DEFAULTS[k]) for k in _USER_FIELDS},
     )
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
-    credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+
+def decode_user_id(token: str) -> str:
+    credentials_exception = _credentials_exception()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.InvalidTokenError:
         raise credentials_exception
-    user = get_user_by_id(user_id)
+    return user_id
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> dict:
+    user_id = decode_user_id(token)
+    user = await get_user_by_id(user_id)
     if user is None:
-        raise credentials_exception
+        raise _credentials_exception()
+    _USER_CACHE[user_id] = user
+    return user
+
+
+async def get_cached_user(token: str = Depends(oauth2_scheme)) -> dict:
+    # Profile fields may be stale; only rely on _id
+    user_id = decode_user_id(token)
+    user = _USER_CACHE.get(user_id)
+    if user is None:
+        user = await get_user_by_id(user_id)
+        if user is None:
+            raise _credentials_exception()
+        _USER_CACHE[user_id] = user
     return user
 
 
@@ -126,34 +229,64 @@ def root():
 
 
 @app.post("/auth/register", response_model=UserPublic)
-def register(user: UserCreate):
+async def register(user: UserCreate):
+    db = get_db()
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    existing = get_user_by_email(user.email)
+    existing = await get_user_by_email(user.email)
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
+    # Hashing is CPU-bound; keep it off the event loop
+    password_hash = await asyncio.to_thread(get_password_hash, user.password)
     user_doc = User(
         email=user.email,
-        password_hash=get_password_hash(user.password),
+        password_hash=password_hash,
         full_name=user.full_name,
     ).model_dump()
-    user_doc["created_at"] = datetime.utcnow()
-    user_doc["updated_at"] = datetime.utcnow()
-    inserted_id = db["user"].insert_one(user_doc).inserted_id
-    created = db["user"].find_one({"_id": inserted_id})
-    return user_entity(created)
+    now = datetime.now(timezone.utc)
+    user_doc["created_at"] = now
+    user_doc["updated_at"] = now
+    try:
+        # insert_one sets user_doc["_id"], so no need to read it back
+        await db["user"].insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    return user_entity(user_doc)
+
+
+def _lower_domain(email: str) -> str:
+    # EmailStr stores the domain lowercased at registration; match that
+    local, _, domain = email.rpartition("@")
+    return f"{local}@{domain.lower()}"
+
+
+# Cheap shape check for the login hot path; full EmailStr parsing stays on register
+LoginEmail = Annotated[
+    str,
+    StringConstraints(strip_whitespace=True, pattern=r"^[^@\s]+@[^@\s]+\.[^@\s]+$"),
+    AfterValidator(_lower_domain),
+]
 
 
 class LoginPayload(BaseModel):
-    email: EmailStr
+    email: LoginEmail
     password: str
 
 
 @app.post("/auth/login", response_model=Token)
-def login(payload: LoginPayload):
-    user = get_user_by_email(payload.email)
-    if not user or not verify_password(payload.password, user.get("password_hash", "")):
+async def login(payload: LoginPayload):
+    user = await get_user_by_email(payload.email)
+    password_hash = user.get("password_hash", "") if user else ""
+    if not user or not await asyncio.to_thread(verify_password, payload.password, password_hash):
         raise HTTPException(status_code=400, detail="Incorrect email or password")
+    if password_needs_rehash(password_hash):
+        # Upgrade to the current argon2 parameters now that we have the plaintext;
+        # matching on the old hash skips the write if it changed meanwhile
+        new_hash = await asyncio.to_thread(get_password_hash, payload.password)
+        await get_db()["user"].update_one(
+            {"_id": user["_id"], "password_hash": password_hash},
+            {"$set": {"password_hash": new_hash}},
+        )
     access_token = create_access_token({"sub": str(user["_id"])})
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -176,21 +309,24 @@ async def me(user: dict = Depends(get_current_user)):
 @app.put("/me", response_model=UserPublic)
 async def update_me(payload: ProfileUpdate, user: dict = Depends(get_current_user)):
     updates = {k: v for k, v in payload.model_dump().items() if v is not None}
-    updates["updated_at"] = datetime.utcnow()
-    db["user"].update_one({"_id": user["_id"]}, {"$set": updates})
-    fresh = db["user"].find_one({"_id": user["_id"]})
+    updates["updated_at"] = datetime.now(timezone.utc)
+    db = get_db()
+    await db["user"].update_one({"_id": user["_id"]}, {"$set": updates})
+    _USER_CACHE.pop(str(user["_id"]), None)
+    fresh = await db["user"].find_one({"_id": user["_id"]})
     return user_entity(fresh)
 
 
 # Discovery: very simple filter (gender preference only for MVP)
-@app.get("/discover", response_model=List[UserPublic])
+@app.get("/discover")
 async def discover(user: dict = Depends(get_current_user)):
     pref = user.get("show_me", "everyone")
-    query = {}
+    query = {"_id": {"$ne": user["_id"]}}
     if pref in ("male", "female"):
         query["gender"] = pref
-    docs = db["user"].find(query).limit(50)
-    return [user_entity(d) for d in docs if str(d.get("_id")) != str(user["_id"])]
+    docs = get_db()["user"].find(query, USER_PUBLIC_PROJECTION).limit(50)
+    users = [user_entity(d) async for d in docs]
+    return ORJSONResponse(USER_PUBLIC_LIST_ADAPTER.dump_python(users))
 
 
 class LikePayload(BaseModel):
@@ -198,62 +334,92 @@ class LikePayload(BaseModel):
 
 
 @app.post("/like")
-async def like(payload: LikePayload, user: dict = Depends(get_current_user)):
-    target = get_user_by_id(payload.target_user_id)
+async def like(payload: LikePayload, user: dict = Depends(get_cached_user)):
+    target = await get_user_by_id(payload.target_user_id)
     if not target:
         raise HTTPException(status_code=404, detail="User not found")
 
     # create like
+    now = datetime.now(timezone.utc)
     like_doc = {
         "liker_id": str(user["_id"]),
         "liked_id": payload.target_user_id,
-        "created_at": datetime.utcnow(),
+        "created_at": now,
     }
-    db["like"].insert_one(like_doc)
-
-    # check for mutual like
-    mutual = db["like"].find_one({
+    db = get_db()
+    try:
+        await db["like"].insert_one(like_doc)
+    except DuplicateKeyError:
+        # already liked; still re-check for a match below
+        pass
+
+    # check for mutual like, then create the match in a single upsert.
+    # The pair is stored in sorted order so the unique index catches races.
+    me = str(user["_id"])
+    mutual = await db["like"].find_one({
         "liker_id": payload.target_user_id,
-        "liked_id": str(user["_id"]) 
+        "liked_id": me,
     })
-    match_created = None
+    match_created = False
     if mutual:
-        # create a match if not already
-        existing_match = db["match"].find_one({
-            "$or": [
-                {"user_a": str(user["_id"]), "user_b": payload.target_user_id},
-                {"user_a": payload.target_user_id, "user_b": str(user["_id"])},
-            ]
-        })
-        if not existing_match:
-            match_doc = {
-                "user_a": str(user["_id"]),
-                "user_b": payload.target_user_id,
-                "created_at": datetime.utcnow(),
-            }
-            db["match"].insert_one(match_doc)
-            match_created = True
-    return {"ok": True, "match": bool(match_created)}
+        user_a, user_b = sorted((me, payload.target_user_id))
+        try:
+            res = await db["match"].update_one(
+                {"user_a": user_a, "user_b": user_b},
+                {"$setOnInsert": {"created_at": now}},
+                upsert=True,
+            )
+            match_created = res.upserted_id is not None
+        except DuplicateKeyError:
+            # the other user's like created the match concurrently
+            pass
+    return {"ok": True, "match": match_created}
 
 
 @app.get("/matches")
-async def matches(user: dict = Depends(get_current_user)):
-    cur = db["match"].find({
+async def matches(user: dict = Depends(get_cached_user)):
+    db = get_db()
+    me = str(user["_id"])
+    match_docs = await db["match"].find({
         "$or": [
-            {"user_a": str(user["_id"])},
-            {"user_b": str(user["_id"])},
+            {"user_a": me},
+            {"user_b": me},
         ]
-    }).sort("created_at", -1)
+    }).sort("created_at", -1).to_list(length=None)
+
+    # fetch every counterpart in one query instead of one per match
+    other_ids = [m["user_b"] if m["user_a"] == me else m["user_a"] for m in match_docs]
+    users = {
+        str(u["_id"]): u
+        async for u in db["user"].find({"_id": {"$in": [ObjectId(i) for i in other_ids]}})
+    }
     results = []
-    for m in cur:
-        other_id = m["user_b"] if m["user_a"] == str(user["_id"]) else m["user_a"]
-        other = get_user_by_id(other_id)
+    for m, other_id in zip(match_docs, other_ids):
+        other = users.get(other_id)
         results.append({
             "id": str(m["_id"]),
-            "other": user_entity(other) if other else None,
+            "other": user_entity(other).model_dump() if other else None,
             "created_at": m.get("created_at"),
         })
-    return {"items": results}
+    return ORJSONResponse({"items": results})
+
+
+async def find_authorized_match(match_id: str, user: dict) -> dict:
+    # Participation is part of the query, so a match the user isn't in looks
+    # exactly like a missing one (404 either way)
+    me = str(user["_id"])
+    try:
+        query = {"_id": ObjectId(match_id), "$or": [{"user_a": me}, {"user_b": me}]}
+    except InvalidId:
+        raise HTTPException(status_code=404, detail="Match not found")
+    match = await get_db()["match"].find_one(query, projection={"_id": 1})
+    if match is None:
+        raise HTTPException(status_code=404, detail="Match not found")
+    return match
+
+
+async def authorized_match(match_id: str, user: dict = Depends(get_cached_user)) -> dict:
+    return await find_authorized_match(match_id, user)
 
 
 class MessagePayload(BaseModel):
@@ -262,49 +428,46 @@ class MessagePayload(BaseModel):
 
 
 @app.post("/messages")
-async def send_message(payload: MessagePayload, user: dict = Depends(get_current_user)):
-    from bson import ObjectId
-    match = db["match"].find_one({"_id": ObjectId(payload.match_id)})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match not found")
-    if str(user["_id"]) not in (match["user_a"], match["user_b"]):
-        raise HTTPException(status_code=403, detail="Not part of this match")
+async def send_message(payload: MessagePayload, user: dict = Depends(get_cached_user)):
+    # match_id comes from the body here, so check it directly rather than via Depends
+    await find_authorized_match(payload.match_id, user)
 
+    db = get_db()
     msg = {
         "match_id": payload.match_id,
         "sender_id": str(user["_id"]),
         "text": payload.text,
-        "created_at": datetime.utcnow(),
+        "created_at": datetime.now(timezone.utc),
     }
-    db["message"].insert_one(msg)
+    await db["message"].insert_one(msg)
     return {"ok": True}
 
 
 @app.get("/messages/{match_id}")
-async def get_messages(match_id: str, user: dict = Depends(get_current_user)):
-    from bson import ObjectId
-    match = db["match"].find_one({"_id": ObjectId(match_id)})
-    if not match:
-        raise HTTPException(status_code=404, detail="Match not found")
-    if str(user["_id"]) not in (match["user_a"], match["user_b"]):
-        raise HTTPException(status_code=403, detail="Not part of this match")
-
-    cur = db["message"].find({"match_id": match_id}).sort("created_at", 1)
-    items = [
-        {
-            "id": str(m["_id"]),
-            "sender_id": m["sender_id"],
-            "text": m.get("text"),
-            "created_at": m.get("created_at"),
-        }
-        for m in cur
-    ]
-    return {"items": items}
+async def get_messages(match_id: str, match: dict = Depends(authorized_match)):
+    cur = get_db()["message"].find({"match_id": match_id}).sort("created_at", 1)
+
+    # Stream {"items": [...]} one message at a time instead of building the
+    # whole history in memory
+    async def gen():
+        yield b'{"items":['
+        prefix = b""
+        async for m in cur:
+            yield prefix + orjson.dumps({
+                "id": str(m["_id"]),
+                "sender_id": m["sender_id"],
+                "text": m.get("text"),
+                "created_at": m.get("created_at"),
+            })
+            prefix = b","
+        yield b"]}"
+
+    return StreamingResponse(gen(), media_type="application/json")
 
 
 # Simple upload stub (for now accept URLs via form field, or file upload later)
 @app.post("/upload")
-async def upload_image(url: Optional[str] = Form(None), file: Optional[UploadFile] = File(None), user: dict = Depends(get_current_user)):
+async def upload_image(url: Optional[str] = Form(None), file: Optional[UploadFile] = File(None), user: dict = Depends(get_cached_user)):
     # In a real app, upload to S3/Cloudinary, return secure URL.
     if url:
         return {"url": url}
@@ -315,14 +478,15 @@ async def upload_image(url: Optional[str] = Form(None), file: Optional[UploadFil
 
 
 @app.get("/test")
-def test_database():
+async def test_database():
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
     }
     try:
+        db = get_db()
         if db is not None:
-            db.list_collection_names()
+            await db.list_collection_names()
             response["database"] = "✅ Connected"
     except Exception as e:
         response["database"] = f"⚠️ {str(e)[:80]}"
@@ -332,4 +496,6 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # workers > 1 needs the app as an import string
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers)
@@ -0,0 +1,84 @@
+"""
+One-off data migrations
+
+Cleans up data written by older versions of the API so the unique indexes
+created at startup (see ensure_indexes in main.py) can be built.
+
+Run once, ideally with the API stopped:
+
+    python migrate.py            # dry run: only report what would change
+    python migrate.py --apply    # make the changes
+"""
+
+import argparse
+
+from database import get_sync_db
+
+
+def find_duplicates(collection, group_key: dict):
+    """Group docs sharing the same group_key expression; ids are oldest first"""
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": group_key, "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ]
+    return list(collection.aggregate(pipeline, allowDiskUse=True))
+
+
+def dedupe_likes(db, apply: bool):
+    """Keep only the oldest like per (liker_id, liked_id)"""
+    groups = find_duplicates(db["like"], {"liker_id": "$liker_id", "liked_id": "$liked_id"})
+    extra = sum(len(g["ids"]) - 1 for g in groups)
+    print(f"like: {extra} duplicate documents across {len(groups)} pairs")
+    if apply:
+        for g in groups:
+            db["like"].delete_many({"_id": {"$in": g["ids"][1:]}})
+
+
+def normalize_matches(db, apply: bool):
+    """Store every match as (user_a, user_b) with user_a < user_b, one per pair
+
+    Older versions stored the liker first, so a pair may exist in both orders.
+    The oldest match per pair is kept and messages of the others move to it.
+    """
+    pair = {
+        "a": {"$min": ["$user_a", "$user_b"]},
+        "b": {"$max": ["$user_a", "$user_b"]},
+    }
+    groups = find_duplicates(db["match"], pair)
+    extra = sum(len(g["ids"]) - 1 for g in groups)
+    print(f"match: {extra} duplicate documents across {len(groups)} pairs")
+    if apply:
+        for g in groups:
+            keep, drop = g["ids"][0], g["ids"][1:]
+            # Delete first: once gone, /messages rejects the old ids, so the
+            # repoint below also catches anything posted in between
+            db["match"].delete_many({"_id": {"$in": drop}})
+            db["message"].update_many(
+                {"match_id": {"$in": [str(i) for i in drop]}},
+                {"$set": {"match_id": str(keep)}},
+            )
+
+    misordered = {"$expr": {"$gt": ["$user_a", "$user_b"]}}
+    print(f"match: {db['match'].count_documents(misordered)} documents with user_a > user_b")
+    if apply:
+        db["match"].update_many(misordered, [{"$set": {"user_a": "$user_b", "user_b": "$user_a"}}])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--apply", action="store_true", help="write changes instead of only counting them")
+    args = parser.parse_args()
+
+    db = get_sync_db()
+    if db is None:
+        raise SystemExit("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+
+    dedupe_likes(db, args.apply)
+    normalize_matches(db, args.apply)
+    if not args.apply:
+        print("Dry run; re-run with --apply to make these changes")
+
+
+if __name__ == "__main__":
+    main()